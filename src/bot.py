@@ -1,10 +1,12 @@
-import telebot
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
 from telebot import types
 
 import yiffer
 
 from typing import List
 
+import asyncio
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -28,104 +30,184 @@ if not token:
     print("Bot token is not defined. Please make a .env file with BOT_TOKEN=\"0123456789:YOUR_TOKEN_HERE\" (YifferComicsBot/src/.env)")
     quit()
 
-bot = telebot.TeleBot(token)
+bot = AsyncTeleBot(token)
+
+yiffer.migrate_database()
+
+# Telegram allows roughly 30 messages per second across all chats.
+MESSAGES_PER_SECOND = 30
+_send_slots = None
+
+async def throttle(messages: int = 1) -> None:
+    # Wait for free send slots. Each slot is given back one second after it was taken,
+    # so no more than MESSAGES_PER_SECOND messages go out in any one second.
+    global _send_slots
+    if _send_slots is None:
+        _send_slots = asyncio.Semaphore(MESSAGES_PER_SECOND)
+    loop = asyncio.get_running_loop()
+    for _ in range(messages):
+        await _send_slots.acquire()
+        loop.call_later(1, _send_slots.release)
+
+async def send_message(chat_id, text: str, **kwargs):
+    await throttle()
+    return await bot.send_message(chat_id, text, **kwargs)
+
+async def edit_message_text(text: str, chat_id, message_id: int, **kwargs):
+    await throttle()
+    return await bot.edit_message_text(text, chat_id, message_id, **kwargs)
+
+async def send_media_group(chat_id, media: list, **kwargs):
+    # Every photo in the group counts as a message.
+    await throttle(len(media))
+    return await bot.send_media_group(chat_id, media, **kwargs)
 
 from telebot.types import InputMediaPhoto
 
-def send_comic_query_to_chat(chat_id, comics: List[yiffer.ComicData]) -> None:
-    # Send all the thumbnails as a media group.
-    # Add the name, artist, page count, state, and tags to the caption.
-    media = []
-    for comic in comics:
-        media.append(InputMediaPhoto(comic.thumbnail, caption=f"{comic.name} - {comic.artist}\nPages: {comic.numberOfPages}\nState: {comic.state}\nTag: {', '.join(comic.tag)}"))
+CAPTION = "{name} - {artist}\nPages: {pages}\nState: {state}\nTag: {tag}"
+
+def get_caption(comic) -> str:
+    # The name, artist, page count, state, and tag of a comic.
+    return CAPTION.format(name=comic.name, artist=comic.artist, pages=comic.numberOfPages, state=comic.state, tag=comic.tag)
 
-    bot.send_media_group(chat_id, media)
+async def send_comic_query_to_chat(chat_id, comics: List[yiffer.ComicSummary]) -> None:
+    # Send all the thumbnails as a media group.
+    # Thumbnails Telegram already has are sent by file_id, so it doesn't fetch them again.
+    media = [InputMediaPhoto(comic.thumbnail_file_id or comic.thumbnail, caption=get_caption(comic)) for comic in comics]
+
+    try:
+        messages = await send_media_group(chat_id, media)
+    except ApiTelegramException:
+        # File_ids only work for the bot that received them, and can expire.
+        # Forget the ones we used and send the thumbnails by URL instead.
+        cached_ids = [comic.id for comic in comics if comic.thumbnail_file_id]
+        if not cached_ids:
+            raise
+        yiffer.ComicSummary.clear_thumbnail_file_ids(cached_ids)
+        for comic in comics:
+            comic.thumbnail_file_id = None
+        media = [InputMediaPhoto(comic.thumbnail, caption=get_caption(comic)) for comic in comics]
+        messages = await send_media_group(chat_id, media)
+
+    # Remember the file_ids of thumbnails sent for the first time.
+    new_file_ids = [(comic.id, message.photo[-1].file_id)
+                    for comic, message in zip(comics, messages)
+                    if comic.thumbnail_file_id is None and message.photo]
+    if new_file_ids:
+        yiffer.ComicSummary.save_thumbnail_file_ids(new_file_ids)
 
     # Add a keyboard with buttons to view each comic.
     keyboard = types.InlineKeyboardMarkup()
     for comic in comics:
-        keyboard.add(types.InlineKeyboardButton(text=comic.name, callback_data=f"comic:{comic.name}"))
+        keyboard.add(types.InlineKeyboardButton(text=comic.name, callback_data=f"comic:{comic.id}"))
     
-    bot.send_message(chat_id, "Select a comic to view:", reply_markup=keyboard)
+    await send_message(chat_id, "Select a comic to view:", reply_markup=keyboard)
 
-def send_comic_to_chat(chat_id, comic_name: str) -> None:
-    comic = yiffer.ComicData.load_from_db(comic_name)
-    if comic is None:
-        bot.send_message(chat_id, "Comic not found.")
-        return
-    bot.send_message(chat_id, f"Loading comic: {comic.name} - {comic.artist}\nPages: {comic.numberOfPages}\nState: {comic.state}\nTag: {', '.join(comic.tag)}")
+async def send_comic_to_chat(chat_id, comic: yiffer.ComicData) -> None:
+    await send_message(chat_id, f"Loading comic: {get_caption(comic)}")
     image_urls = comic.pages
     # We have to paginate because media max size is 10.
     page_size = 10
-    media_groups = [image_urls[i:i + page_size] for i in range(0, len(image_urls), page_size)]
-    for media_group in media_groups:
-        media = [InputMediaPhoto(url) for url in media_group]
-        if media:
-            bot.send_media_group(chat_id, media)
+    # Each group is built right before it is sent, so the first pages go out straight away.
+    # Groups are awaited one after another so the pages arrive in order.
+    # Other chats are served in the meantime.
+    for i in range(0, len(image_urls), page_size):
+        media = [InputMediaPhoto(url) for url in image_urls[i:i + page_size]]
+        await send_media_group(chat_id, media)
 
 
 # View Comic Callback
 @bot.callback_query_handler(func=lambda call: call.data.startswith("comic:"))
-def callback_query(call):
-    comic_name = call.data.split(":")[1]
-    comic = yiffer.ComicData.load_from_db(comic_name)
+async def callback_query(call):
+    comic_id = call.data.split(":", 1)[1]
+    if comic_id.isdigit():
+        comic = yiffer.ComicData.load_from_db_by_id(int(comic_id))
+    else:
+        # Buttons sent before comics were referenced by id carry the name instead.
+        comic = yiffer.ComicData.load_from_db(comic_id)
     if comic is None:
-        bot.send_message(call.message.chat.id, "Comic not found.")
+        await send_message(call.message.chat.id, "Comic not found.")
         return
-    send_comic_to_chat(call.message.chat.id, comic_name)
+    await send_comic_to_chat(call.message.chat.id, comic)
 
 @bot.message_handler(commands=['start'])
-def cmd_start(message):
-    bot.send_message(message.chat.id, "Welcome to YifferComicBot! \n\nUse /help to see the commands available.")
+async def cmd_start(message):
+    await send_message(message.chat.id, "Welcome to YifferComicBot! \n\nUse /help to see the commands available.")
 
 @bot.message_handler(commands=['help'])
-def cmd_help(message):
-    command_text = "\n\n\t".join([f"{cmd.command} - {cmd.description}" for cmd in bot.get_my_commands()])
-    bot.send_message(message.chat.id, command_text)
+async def cmd_help(message):
+    command_text = "\n\n\t".join([f"{cmd.command} - {cmd.description}" for cmd in await bot.get_my_commands()])
+    await send_message(message.chat.id, command_text)
 
 @bot.message_handler(commands=['comics'])
-def cmd_comics(message):
+async def cmd_comics(message):
     args = message.text.split(" ")[1:]
     if len(args) == 0:
-        bot.send_message(message.chat.id, f"Please specify a page number. Pages: 1-{yiffer.ComicData.get_max_page_number()}.")
+        await send_message(message.chat.id, f"Please specify a page number. Pages: 1-{yiffer.ComicData.get_max_page_number()}.")
         return
     page_number = args[0]
     if not page_number.isdigit():
-        bot.send_message(message.chat.id, "Please specify a valid page number.")
+        await send_message(message.chat.id, "Please specify a valid page number.")
         return
     
-    comics = yiffer.ComicData.search_comics_by_page(int(page_number))
+    comics = yiffer.ComicData.search_comics_summaries_by_page(int(page_number))
 
     if len(comics) == 0:
-        bot.send_message(message.chat.id, "No comics found.")
+        await send_message(message.chat.id, "No comics found.")
         return
     
-    bot.send_message(message.chat.id, f"Page {page_number} of {yiffer.ComicData.get_max_page_number()}:")
+    await send_message(message.chat.id, f"Page {page_number} of {yiffer.ComicData.get_max_page_number()}:")
     
-    send_comic_query_to_chat(message.chat.id, comics)
+    await send_comic_query_to_chat(message.chat.id, comics)
 
 @bot.message_handler(commands=['search'])
-def cmd_search(message):
+async def cmd_search(message):
     args = message.text.split(" ")[1:]
     if len(args) == 0:
-        bot.send_message(message.chat.id, "Please specify a comic name.")
+        await send_message(message.chat.id, "Please specify a comic name.")
         return
     query = " ".join(args)
-    comics = yiffer.ComicData.search_comics_by_name(query)
+    comics = yiffer.ComicData.search_comics_summaries_by_name(query)
     if len(comics) == 0:
-        bot.send_message(message.chat.id, "No comics found.")
+        await send_message(message.chat.id, "No comics found.")
         return
-    bot.send_message(message.chat.id, f"Search results for '{query}':")
-    send_comic_query_to_chat(message.chat.id, comics)
+    await send_message(message.chat.id, f"Search results for '{query}':")
+    await send_comic_query_to_chat(message.chat.id, comics)
     
-@bot.message_handler(commands=['keywords'])
-def cmd_keywords(message):
-    keywords_query = yiffer.ComicData.get_keywords_by_count() # [(str, int), (str, int), ...]
-    # Paginate the keywords.
-    # Send 10 at a time. 
+def get_keywords_page(page_number: int):
+    # Build the text and navigation buttons for one page of keywords.
+    max_page = yiffer.ComicData.get_max_keyword_page_number()
+    page_number = min(max(page_number, 1), max_page)
+    keywords = yiffer.ComicData.get_keywords_by_count(page_number) # [(str, int), (str, int), ...]
+
+    lines = "\n".join(f"{keyword} ({count})" for keyword, count in keywords)
+    text = f"Keywords, page {page_number} of {max_page}:\n\n{lines}"
+
     # Add buttons to go left and right through the keywords.
-    
-    
+    buttons = []
+    if page_number > 1:
+        buttons.append(types.InlineKeyboardButton(text="<", callback_data=f"keywords:{page_number - 1}"))
+    if page_number < max_page:
+        buttons.append(types.InlineKeyboardButton(text=">", callback_data=f"keywords:{page_number + 1}"))
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.row(*buttons)
+
+    return text, keyboard
+
+# Keywords Page Callback
+@bot.callback_query_handler(func=lambda call: call.data.startswith("keywords:"))
+async def callback_keywords(call):
+    page_number = call.data.split(":")[1]
+    if not page_number.isdigit():
+        return
+    text, keyboard = get_keywords_page(int(page_number))
+    await edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+
+@bot.message_handler(commands=['keywords'])
+async def cmd_keywords(message):
+    # Send the first page of keywords. The buttons page through the rest.
+    text, keyboard = get_keywords_page(1)
+    await send_message(message.chat.id, text, reply_markup=keyboard)
 
 
-bot.infinity_polling()
\ No newline at end of file
+asyncio.run(bot.infinity_polling())
\ No newline at end of file
@@ -1,3 +1,5 @@
 from .yiffer import (
     ComicData,
+    ComicSummary,
+    migrate_database,
 )
\ No newline at end of file
@@ -21,15 +21,22 @@ requests will only be used for JSON data from API
 """
 from typing import (
     List,
+    Tuple,
 )
 from datetime import datetime
 from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote
 
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 
 import sqlite3
-import difflib
-import json
+import threading
 import time
 import os
 
@@ -39,10 +46,55 @@ STATIC_URL = 'https://static.yiffer.xyz'
 API_URL = f'{BASE_URL}/api'
 THUMBNAIL_URL = f"{STATIC_URL}/comics/{{comic_name}}/thumbnail.webp"
 COMICS_URL = f"{STATIC_URL}/comics/{{comic_name}}/{{page_number:03d}}.jpg"
+# Columns of the comics table, in the order ComicData._from_row expects them
+COMIC_COLUMNS = "id, name, thumbnail, category, tag, artist, state, created, updated, userRating, numberOfPages"
+# Columns needed to list a comic, in the order ComicSummary._from_row expects them
+SUMMARY_COLUMNS = "comics.id, comics.name, comics.thumbnail, comics.artist, comics.state, comics.tag, comics.numberOfPages, comics.thumbnail_file_id"
+
+# Most API requests we make to yiffer.xyz at the same time
+MAX_CONCURRENT_REQUESTS = 16
+# Seconds to wait for the API before giving up on a request
+REQUEST_TIMEOUT = 10
+
+# One HTTP session for every API call, so connections (and their TLS sessions) are kept alive.
+# requests already asks for gzip responses by default.
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(
+    pool_connections=MAX_CONCURRENT_REQUESTS,
+    pool_maxsize=MAX_CONCURRENT_REQUESTS * 2,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+))
+
+# One connection per thread, reused for every query made from that thread.
+_local = threading.local()
+
+# Recently loaded comics by name, so browsing the same comic twice doesn't hit the database.
+# The cache is per process: comics saved by another process (update_db run as a script)
+# only show up here once their entry expires, so the TTL bounds how stale they get.
+_comic_cache = TTLCache(maxsize=2048, ttl=300)
+# Keyword pages and counts, which only change when update_db runs
+_keyword_cache = TTLCache(maxsize=256, ttl=60)
+
+
+def _get_connection() -> sqlite3.Connection:
+    """
+    Gets the shared database connection for the current thread,
+    opening and configuring it on first use.
+    :return: sqlite3 connection
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")
+        _local.conn = conn
+    return conn
 
 
 def create_database():
-    conn = sqlite3.connect(DATABASE)
+    conn = _get_connection()
     c = conn.cursor()
 
     # Create comics table
@@ -56,7 +108,9 @@ def create_database():
                   state TEXT,
                   created TIMESTAMP,
                   updated TIMESTAMP,
-                  userRating REAL)""")
+                  userRating REAL,
+                  numberOfPages INTEGER,
+                  thumbnail_file_id TEXT)""")
 
     # Create pages table
     c.execute("""CREATE TABLE pages
@@ -74,7 +128,88 @@ def create_database():
                   FOREIGN KEY (comic_id) REFERENCES comics(id))""")
 
     conn.commit()
-    conn.close()
+
+    migrate_database()
+
+
+def migrate_database():
+    """
+    Brings an existing database up to date with the current schema.
+    Safe to run on every startup, it only creates what is missing.
+    """
+    conn = _get_connection()
+    c = conn.cursor()
+
+    # Full-text index over the searchable comic columns, kept in sync by triggers
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='comics_fts'")
+    has_fts = c.fetchone() is not None
+
+    c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS comics_fts USING fts5
+                 (name, artist, category, tag,
+                  content='comics', content_rowid='id', tokenize='unicode61')""")
+
+    c.execute("""CREATE TRIGGER IF NOT EXISTS comics_fts_insert AFTER INSERT ON comics BEGIN
+                    INSERT INTO comics_fts (rowid, name, artist, category, tag)
+                    VALUES (new.id, new.name, new.artist, new.category, new.tag);
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS comics_fts_delete AFTER DELETE ON comics BEGIN
+                    INSERT INTO comics_fts (comics_fts, rowid, name, artist, category, tag)
+                    VALUES ('delete', old.id, old.name, old.artist, old.category, old.tag);
+                 END""")
+    # Only reindex when an indexed column changes, not on page count or file_id updates.
+    # Databases from before this carry an AFTER UPDATE trigger on every column, so replace it.
+    c.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='comics_fts_update'")
+    update_trigger = c.fetchone()
+    if update_trigger is not None and 'UPDATE OF' not in update_trigger[0]:
+        c.execute("DROP TRIGGER comics_fts_update")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS comics_fts_update AFTER UPDATE OF name, artist, category, tag ON comics BEGIN
+                    INSERT INTO comics_fts (comics_fts, rowid, name, artist, category, tag)
+                    VALUES ('delete', old.id, old.name, old.artist, old.category, old.tag);
+                    INSERT INTO comics_fts (rowid, name, artist, category, tag)
+                    VALUES (new.id, new.name, new.artist, new.category, new.tag);
+                 END""")
+
+    # Index the comics that were already there before the FTS table existed
+    if not has_fts:
+        c.execute("INSERT INTO comics_fts (comics_fts) VALUES ('rebuild')")
+
+    # Store the page count on the comic itself, counting the pages of existing comics
+    c.execute("PRAGMA table_info(comics)")
+    comic_columns = [row[1] for row in c.fetchall()]
+    if 'numberOfPages' not in comic_columns:
+        c.execute("ALTER TABLE comics ADD COLUMN numberOfPages INTEGER")
+        c.execute("UPDATE comics SET numberOfPages = (SELECT COUNT(*) FROM pages WHERE comic_name = comics.name)")
+
+    # Telegram file_id of each thumbnail, once it has been sent
+    if 'thumbnail_file_id' not in comic_columns:
+        c.execute("ALTER TABLE comics ADD COLUMN thumbnail_file_id TEXT")
+
+    # Indexes for looking comics up by name and listing them by rating.
+    # pages and keywords are already indexed by their UNIQUE constraints.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_comics_name'")
+    if c.fetchone() is None:
+        # Older databases can hold a comic twice under the same name, when yiffer re-listed it with a new id.
+        # Keep the newest id for each name, so the name can be made unique.
+        c.execute("""DELETE FROM keywords WHERE comic_id IN
+                     (SELECT id FROM comics WHERE id NOT IN (SELECT MAX(id) FROM comics GROUP BY name))""")
+        c.execute("DELETE FROM comics WHERE id NOT IN (SELECT MAX(id) FROM comics GROUP BY name)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_comics_name ON comics (name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_comics_rating ON comics (userRating DESC)")
+
+    conn.commit()
+
+
+def _build_fts_query(column: str, query: str) -> str:
+    """
+    Builds an FTS5 MATCH expression that prefix-matches every word of a query in one column.
+    :param column: Column of comics_fts to search
+    :param query: Raw text typed by the user
+    :return: MATCH expression, or an empty string if the query has no words
+    """
+    terms = ['"{}"*'.format(word.replace('"', '""')) for word in query.split()]
+    if not terms:
+        return ''
+    return f"{column} : ({' '.join(terms)})"
 
 
 
@@ -107,6 +242,55 @@ class DetailedComicData:
     keywords: List[str] = field(default_factory=list)
 
 
+@dataclass
+class ComicSummary:
+    # Just what is needed to show a comic in a list, without pages or keywords
+    id: int
+    name: str
+    thumbnail: str
+    artist: str
+    state: str
+    tag: str
+    numberOfPages: int
+    thumbnail_file_id: str = None # Telegram's id for the thumbnail, once it has been sent
+
+    @classmethod
+    def _from_row(cls, comic_data: tuple):
+        # comic_data holds the comics columns in SUMMARY_COLUMNS order
+        return cls(
+            id=comic_data[0],
+            name=comic_data[1],
+            thumbnail=comic_data[2],
+            artist=comic_data[3],
+            state=comic_data[4],
+            tag=comic_data[5],
+            numberOfPages=comic_data[6],
+            thumbnail_file_id=comic_data[7],
+        )
+
+    @staticmethod
+    def save_thumbnail_file_ids(file_ids: List[Tuple[int, str]]):
+        """
+        Saves the Telegram file_ids of uploaded thumbnails, so they can be sent again without refetching.
+        :param file_ids: List of (comic id, file_id)
+        """
+        conn = _get_connection()
+        with conn:
+            conn.executemany("UPDATE comics SET thumbnail_file_id=? WHERE id=?",
+                             [(file_id, comic_id) for comic_id, file_id in file_ids])
+
+    @staticmethod
+    def clear_thumbnail_file_ids(comic_ids: List[int]):
+        """
+        Forgets stored thumbnail file_ids, e.g. after Telegram rejected them, so the URLs are sent again.
+        :param comic_ids: Ids of comics
+        """
+        conn = _get_connection()
+        with conn:
+            conn.execute("UPDATE comics SET thumbnail_file_id=NULL WHERE id IN ({})".format(", ".join("?" * len(comic_ids))),
+                         tuple(comic_ids))
+
+
 @dataclass
 class ComicData:
     # Combine BasicComicData and DetailedComicData
@@ -125,24 +309,41 @@ class ComicData:
     pages: List[str] = field(default_factory=list) # Our own list of pages
 
     def save_to_db(self):
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-
-        # Save comic details to the comics table
-        c.execute("""INSERT OR REPLACE INTO comics (id, name, thumbnail, category, tag, artist, state, created, updated, userRating)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (self.id, self.name, self.thumbnail, self.category, self.tag, self.artist, self.state, self.created, self.updated, self.userRating))
-
-        # Save pages to the pages table
-        for i, page_url in enumerate(self.pages, 1):
-            c.execute("INSERT OR IGNORE INTO pages (comic_name, page_number, page_url) VALUES (?, ?, ?)", (self.name, i, page_url))
-
-        # Save keywords to the keywords table
-        for keyword in self.keywords:
-            c.execute("INSERT INTO keywords (comic_id, keyword) VALUES (?, ?)", (self.id, keyword))
-
-        conn.commit()
-        conn.close()
+        conn = _get_connection()
+
+        # Whatever this process had cached for this comic is about to be out of date.
+        # Other processes keep their copy until it expires.
+        _comic_cache.pop(self.name, None)
+
+        # Everything below is written in a single transaction
+        with conn:
+            c = conn.cursor()
+
+            # A comic re-listed under a new id still has its old row, which holds the same name.
+            # Drop that row (the delete trigger takes it out of comics_fts) so the name stays unique.
+            c.execute("DELETE FROM keywords WHERE comic_id IN (SELECT id FROM comics WHERE name=? AND id!=?)", (self.name, self.id))
+            c.execute("DELETE FROM comics WHERE name=? AND id!=?", (self.name, self.id))
+
+            # Save comic details to the comics table.
+            # An upsert fires the UPDATE trigger, so comics_fts stays in sync (REPLACE would not).
+            # The Telegram file_id is kept unless the thumbnail it was uploaded from changed.
+            c.execute("""INSERT INTO comics (id, name, thumbnail, category, tag, artist, state, created, updated, userRating, numberOfPages)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (id) DO UPDATE SET
+                            name=excluded.name, thumbnail=excluded.thumbnail, category=excluded.category,
+                            tag=excluded.tag, artist=excluded.artist, state=excluded.state,
+                            created=excluded.created, updated=excluded.updated, userRating=excluded.userRating,
+                            numberOfPages=excluded.numberOfPages,
+                            thumbnail_file_id=CASE WHEN excluded.thumbnail IS comics.thumbnail THEN comics.thumbnail_file_id END""",
+                    (self.id, self.name, self.thumbnail, self.category, self.tag, self.artist, self.state, self.created, self.updated, self.userRating, self.numberOfPages))
+
+            # Save pages to the pages table
+            c.executemany("INSERT OR IGNORE INTO pages (comic_name, page_number, page_url) VALUES (?, ?, ?)",
+                          [(self.name, i, page_url) for i, page_url in enumerate(self.pages, 1)])
+
+            # Save keywords to the keywords table, skipping the ones we already have
+            c.executemany("INSERT OR IGNORE INTO keywords (comic_id, keyword) VALUES (?, ?)",
+                          [(self.id, keyword) for keyword in self.keywords])
 
 
     @classmethod
@@ -165,204 +366,256 @@ class ComicData:
     
     @classmethod
     def load_from_db(cls, comic_name: str):
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+        comic = _comic_cache.get(comic_name)
+        if comic is not None:
+            return comic
+
+        c = _get_connection().cursor()
 
         # Retrieve comic data from the comics table
-        c.execute("SELECT * FROM comics WHERE name=?", (comic_name,))
+        c.execute(f"SELECT {COMIC_COLUMNS} FROM comics WHERE name=?", (comic_name,))
+        return cls._load_from_row(c.fetchone())
+
+    @classmethod
+    def load_from_db_by_id(cls, comic_id: int):
+        c = _get_connection().cursor()
+
+        # Retrieve comic data from the comics table by primary key
+        c.execute(f"SELECT {COMIC_COLUMNS} FROM comics WHERE id=?", (comic_id,))
         comic_data = c.fetchone()
+        if comic_data is None:
+            return None
+
+        comic = _comic_cache.get(comic_data[1])
+        if comic is not None:
+            return comic
+
+        return cls._load_from_row(comic_data)
+
+    @classmethod
+    def _load_from_row(cls, comic_data: tuple):
+        if comic_data is None:
+            return None
+
+        c = _get_connection().cursor()
 
         # Retrieve pages from the pages table
-        c.execute("SELECT page_url FROM pages WHERE comic_name=? ORDER BY page_number", (comic_name,))
+        c.execute("SELECT page_url FROM pages WHERE comic_name=? ORDER BY page_number", (comic_data[1],))
         pages = [row[0] for row in c.fetchall()]
 
         # Retrieve keywords from the keywords table
         c.execute("SELECT keyword FROM keywords WHERE comic_id=?", (comic_data[0],))
         keywords = [row[0] for row in c.fetchall()]
 
-        conn.close()
-
         # Build FullComicData object
+        comic = cls._from_row(comic_data, keywords, pages)
+        _comic_cache[comic.name] = comic
+
+        return comic
+
+    @classmethod
+    def _from_row(cls, comic_data: tuple, keywords: List[str], pages: List[str]):
+        # comic_data holds the comics columns in COMIC_COLUMNS order
         return cls(
             id=comic_data[0],
             name=comic_data[1],
             thumbnail=comic_data[2],
             category=comic_data[3],
-            numberOfPages=len(pages),
             tag=comic_data[4],
             artist=comic_data[5],
             state=comic_data[6],
             created=comic_data[7],
             updated=comic_data[8],
             userRating=comic_data[9],
+            numberOfPages=comic_data[10],
             keywords=keywords,
             pages=pages
         )
 
-    @staticmethod
-    def search_by_keywords(keywords: List[str], limit: int = 10) -> List['ComicData']:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-
-        # Use string formatting to build a query string based on the number of keywords
-        query_string = "SELECT DISTINCT comic_id FROM keywords WHERE keyword IN ({})".format(", ".join("?" * len(keywords)))
-        c.execute(query_string, tuple(keywords))
-
-        # Get the top matching comic IDs
-        matching_comic_ids = [row[0] for row in c.fetchall()][:limit]
+    @classmethod
+    def load_many_from_db(cls, comic_names: List[str]) -> List['ComicData']:
+        """
+        Loads several comics at once using three queries in total,
+        instead of three queries per comic.
+        :param comic_names: Names of comics, in the order they should be returned
+        :return: List of comics found, in the same order as comic_names
+        """
+        if not comic_names:
+            return []
 
-        # Retrieve FullComicData objects for the top comics
-        matched_comics = [ComicData.load_from_db(comic_id) for comic_id in matching_comic_ids]
+        c = _get_connection().cursor()
+        placeholders = ", ".join("?" * len(comic_names))
 
-        conn.close()
+        # Retrieve comic data from the comics table
+        c.execute(f"SELECT {COMIC_COLUMNS} FROM comics WHERE name IN ({placeholders})", tuple(comic_names))
+        comics_by_name = {row[1]: row for row in c.fetchall()}
+
+        # Retrieve pages from the pages table, grouped by comic name
+        pages_by_name = {name: [] for name in comics_by_name}
+        c.execute(f"SELECT comic_name, page_url FROM pages WHERE comic_name IN ({placeholders}) ORDER BY comic_name, page_number", tuple(comic_names))
+        for comic_name, page_url in c.fetchall():
+            pages_by_name[comic_name].append(page_url)
+
+        # Retrieve keywords from the keywords table, grouped by comic id
+        comic_ids = tuple(row[0] for row in comics_by_name.values())
+        keywords_by_id = {comic_id: [] for comic_id in comic_ids}
+        c.execute("SELECT comic_id, keyword FROM keywords WHERE comic_id IN ({})".format(", ".join("?" * len(comic_ids))), comic_ids)
+        for comic_id, keyword in c.fetchall():
+            keywords_by_id[comic_id].append(keyword)
+
+        # Build ComicData objects in the requested order
+        matched_comics = []
+        for name in comic_names:
+            comic_data = comics_by_name.get(name)
+            if comic_data is None:
+                continue
+            matched_comics.append(cls._from_row(comic_data, keywords_by_id[comic_data[0]], pages_by_name[name]))
 
         return matched_comics
 
     @staticmethod
-    def search_comics_by_name(query: str, limit: int = 10) -> List['ComicData']:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+    def search_by_keywords(keywords: List[str], limit: int = 10) -> List['ComicData']:
+        c = _get_connection().cursor()
 
-        # Retrieve all comic names from the comics table
-        c.execute("SELECT name FROM comics")
-        all_comics = c.fetchall()
+        # Use string formatting to build a query string based on the number of keywords
+        query_string = """SELECT DISTINCT comics.name FROM keywords
+                          JOIN comics ON comics.id = keywords.comic_id
+                          WHERE keyword IN ({})""".format(", ".join("?" * len(keywords)))
+        c.execute(query_string, tuple(keywords))
 
-        # Find the top 10 closest matching comic names
-        closest_matches = difflib.get_close_matches(query.title(), [comic[0] for comic in all_comics], n=limit, cutoff=0.3)
+        # Get the top matching comic names
+        matching_comic_names = [row[0] for row in c.fetchall()][:limit]
 
-        if not closest_matches:
+        # Retrieve ComicData objects for the top comics
+        return ComicData.load_many_from_db(matching_comic_names)
+
+    @staticmethod
+    def _search_comics_by_column(column: str, query: str, limit: int) -> List['ComicData']:
+        match = _build_fts_query(column, query)
+        if not match:
             return []
 
-        # Retrieve ComicData objects for the closest matches
-        matched_comics = []
-        for comic_name in closest_matches:
-            matched_comics.append(ComicData.load_from_db(comic_name))
+        c = _get_connection().cursor()
 
-        conn.close()
+        # Find the best matching comics, using the full-text index
+        c.execute("SELECT name FROM comics_fts WHERE comics_fts MATCH ? ORDER BY bm25(comics_fts) LIMIT ?", (match, limit))
+        comic_names = [row[0] for row in c.fetchall()]
 
-        return matched_comics
+        # Retrieve ComicData objects for the closest matches
+        return ComicData.load_many_from_db(comic_names)
 
     @staticmethod
-    def search_comics_by_artist(query: str, limit: int = 10) -> List['ComicData']:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-
-        # Retrieve all comic artists from the comics table
-        c.execute("SELECT id, artist FROM comics")
-        all_comics = c.fetchall()
+    def search_comics_by_name(query: str, limit: int = 10) -> List['ComicData']:
+        return ComicData._search_comics_by_column('name', query, limit)
 
-        # Find the top 10 closest matching comic artists
-        closest_matches = difflib.get_close_matches(query, [comic[1] for comic in all_comics], n=limit)
+    @staticmethod
+    def search_comics_summaries_by_name(query: str, limit: int = 10) -> List[ComicSummary]:
+        match = _build_fts_query('name', query)
+        if not match:
+            return []
 
-        # Retrieve ComicData objects for the closest matches
-        matched_comics = []
-        for comic_artist in closest_matches:
-            comic_id = next((comic[0] for comic in all_comics if comic[1] == comic_artist), None)
-            if comic_id:
-                matched_comics.append(ComicData.load_from_db(comic_id))
+        c = _get_connection().cursor()
 
-        conn.close()
+        # Find the best matching comics and everything needed to list them, in one query
+        c.execute(f"""SELECT {SUMMARY_COLUMNS} FROM comics_fts
+                      JOIN comics ON comics.id = comics_fts.rowid
+                      WHERE comics_fts MATCH ?
+                      ORDER BY bm25(comics_fts) LIMIT ?""", (match, limit))
+        return [ComicSummary._from_row(row) for row in c.fetchall()]
 
-        return matched_comics
+    @staticmethod
+    def search_comics_by_artist(query: str, limit: int = 10) -> List['ComicData']:
+        return ComicData._search_comics_by_column('artist', query, limit)
     
     @staticmethod
     def search_comics_by_category(query: str, limit: int = 10) -> List['ComicData']:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-
-        # Retrieve all comic categories from the comics table
-        c.execute("SELECT id, category FROM comics")
-        all_comics = c.fetchall()
-
-        # Find the top 10 closest matching comic categories
-        closest_matches = difflib.get_close_matches(query, [comic[1] for comic in all_comics], n=limit)
-
-        # Retrieve ComicData objects for the closest matches
-        matched_comics = []
-        for comic_category in closest_matches:
-            comic_id = next((comic[0] for comic in all_comics if comic[1] == comic_category), None)
-            if comic_id:
-                matched_comics.append(ComicData.load_from_db(comic_id))
-
-        conn.close()
-
-        return matched_comics
+        return ComicData._search_comics_by_column('category', query, limit)
     
     @staticmethod
     def search_comics_by_tag(query: str, limit: int = 10) -> List['ComicData']:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-
-        # Retrieve all comic tags from the comics table
-        c.execute("SELECT id, tag FROM comics")
-        all_comics = c.fetchall()
-
-        # Find the top 10 closest matching comic tags
-        closest_matches = difflib.get_close_matches(query, [comic[1] for comic in all_comics], n=limit)
-
-        # Retrieve ComicData objects for the closest matches
-        matched_comics = []
-        for comic_tag in closest_matches:
-            comic_id = next((comic[0] for comic in all_comics if comic[1] == comic_tag), None)
-            if comic_id:
-                matched_comics.append(ComicData.load_from_db(comic_id))
-
-        conn.close()
-
-        return matched_comics
+        return ComicData._search_comics_by_column('tag', query, limit)
     
     @staticmethod
     def search_comics_by_page(page: int, limit: int = 10) -> List['ComicData']:
         # Order by the comic ID then offset by the page number
         offset = (page - 1) * limit
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+        c = _get_connection().cursor()
 
-        # Retrieve the comic IDs for the page
+        # Retrieve the comic names for the page
         c.execute("SELECT name FROM comics ORDER BY userRating DESC LIMIT ? OFFSET ?", (limit, offset))
         comic_names = [row[0] for row in c.fetchall()]
 
-        # Retrieve ComicData objects for the closest matches
-        matched_comics = []
-        for name in comic_names:
-            matched_comics.append(ComicData.load_from_db(name))
+        # Retrieve ComicData objects for the page
+        return ComicData.load_many_from_db(comic_names)
 
-        conn.close()
+    @staticmethod
+    def search_comics_summaries_by_page(page: int, limit: int = 10) -> List[ComicSummary]:
+        # Same ordering as search_comics_by_page, but only what is needed to list the comics
+        offset = (page - 1) * limit
+        c = _get_connection().cursor()
 
-        return matched_comics
+        c.execute(f"SELECT {SUMMARY_COLUMNS} FROM comics ORDER BY userRating DESC LIMIT ? OFFSET ?", (limit, offset))
+        return [ComicSummary._from_row(row) for row in c.fetchall()]
     
     @staticmethod
     def get_max_page_number() -> int:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+        c = _get_connection().cursor()
 
         # Retrieve the number of comics
         c.execute("SELECT COUNT(*) FROM comics")
         number_of_comics = c.fetchone()[0]
 
-        conn.close()
-
         return round((number_of_comics - 1) / 10)
     
     @staticmethod
-    def get_keywords_by_count() -> List[str]:
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
+    def get_keywords_by_count(page: int = 1, limit: int = 10) -> List[Tuple[str, int]]:
+        key = ('page', page, limit)
+        if key in _keyword_cache:
+            return _keyword_cache[key]
+
+        offset = (page - 1) * limit
+        c = _get_connection().cursor()
 
-        # Save comic details to the comics table
+        # Retrieve one page of keywords, most used first
         c.execute("""SELECT keyword, COUNT(*) as count
                     FROM keywords
                     GROUP BY keyword
-                    ORDER BY count DESC;""")
-        
+                    ORDER BY count DESC, keyword
+                    LIMIT ? OFFSET ?""", (limit, offset))
         results = c.fetchall()
-        print(results)
 
+        _keyword_cache[key] = results
+        return results
 
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def get_max_keyword_page_number(limit: int = 10) -> int:
+        key = ('max_page', limit)
+        if key in _keyword_cache:
+            return _keyword_cache[key]
+
+        c = _get_connection().cursor()
+
+        # Retrieve the number of distinct keywords
+        c.execute("SELECT COUNT(DISTINCT keyword) FROM keywords")
+        number_of_keywords = c.fetchone()[0]
+
+        max_page = max(1, (number_of_keywords + limit - 1) // limit)
+        _keyword_cache[key] = max_page
+        return max_page
+
+def _try_get_comic_data_by_name(name: str) -> DetailedComicData:
+    """
+    Like get_comic_data_by_name, but returns None instead of raising on unexpected data,
+    so one bad comic doesn't stop the others from being fetched.
+    :param name: Name of comic
+    :return: Comic data, or None if it could not be fetched
+    """
+    try:
+        return get_comic_data_by_name(name)
+    except (KeyError, orjson.JSONDecodeError) as e:
+        print(f"Error getting details for {name}: {e!r}")
+        return None
 
-        return results
 
 def update_db():
     start = time.perf_counter()
@@ -371,32 +624,45 @@ def update_db():
 
     # Get JSON of every single comic
     comics = get_all_comics()
+    if comics is None:
+        print("Could not get the list of comics, nothing was updated.")
+        return
 
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
+    c = _get_connection().cursor()
 
-    comics_new_pages = []
+    # Count the pages we already have for every comic in one query
+    c.execute("SELECT comic_name, COUNT(*) FROM pages GROUP BY comic_name")
+    existing_page_counts = dict(c.fetchall())
+
+    comics_to_update = []
 
     # Loop over each comic
     for basic_comic_data in comics:
 
-        # Get the name of the comic
-        name = basic_comic_data.name
-
-        # Get any pages we may have
-        c.execute("""SELECT * FROM pages WHERE comic_name=?""", (name,))
-        existing_pages = c.fetchall()
+        # Get the number of pages we may have
+        existing_page_count = existing_page_counts.get(basic_comic_data.name, 0)
 
         # If we don't have any pages, or we don't have enough pages, add the comic to the database
-        if (len(existing_pages) < basic_comic_data.numberOfPages):
-            detailed_comic_data = get_comic_data_by_name(name)
+        if (existing_page_count < basic_comic_data.numberOfPages):
+            comics_to_update.append((basic_comic_data, existing_page_count))
 
-            comic_data = ComicData.from_basic_and_detailed(basic_comic_data, detailed_comic_data)
-            comic_data.save_to_db()
+    # Fetch the details of every comic that needs updating concurrently
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        detailed_comics = list(executor.map(_try_get_comic_data_by_name, [basic.name for basic, _ in comics_to_update]))
+
+    comics_new_pages = []
+
+    # Save them from this thread, which owns the database connection
+    for (basic_comic_data, existing_page_count), detailed_comic_data in zip(comics_to_update, detailed_comics):
+        name = basic_comic_data.name
+        if detailed_comic_data is None:
+            print(f"Could not get details for {name}, skipping.")
+            continue
 
-            comics_new_pages.append(f"{name} ({len(existing_pages)} -> {comic_data.numberOfPages})")
+        comic_data = ComicData.from_basic_and_detailed(basic_comic_data, detailed_comic_data)
+        comic_data.save_to_db()
 
-        conn.commit()
+        comics_new_pages.append(f"{name} ({existing_page_count} -> {comic_data.numberOfPages})")
 
     if comics_new_pages:
         new_pages = '\n\t'.join(comics_new_pages)
@@ -405,15 +671,26 @@ def update_db():
     print(f"Updated {len(comics_new_pages)} new comics in {(time.perf_counter() - start):.2f} seconds.")
 
 
+def _encode_comic_name(name: str) -> str:
+    """
+    URL-encodes a comic name for use as a path segment.
+    :param name: Name of comic
+    :return: Encoded name
+    """
+    return quote(name, safe='')
+
+
+@lru_cache(maxsize=None)
 def get_comic_thumbnail_by_name(name: str) -> str:
     """
     Gets a URL for a comic thumbnail by name.
     :param name: Name of comic
     :return: URL for comic thumbnail
     """
-    return THUMBNAIL_URL.format(comic_name=name.replace(' ', '%20'))
+    return THUMBNAIL_URL.format(comic_name=_encode_comic_name(name))
 
 
+@lru_cache(maxsize=None)
 def get_comic_page_by_name_and_page(name: str, page: int) -> str:
     """
     Gets a URL for a comic page by name and page number.
@@ -421,7 +698,7 @@ def get_comic_page_by_name_and_page(name: str, page: int) -> str:
     :param page: Page number
     :return: URL for comic page
     """
-    return COMICS_URL.format(comic_name=name.replace(' ', '%20'), page_number=page)
+    return COMICS_URL.format(comic_name=_encode_comic_name(name), page_number=page)
 
 
 def get_comic_pages_by_name_and_pages(name: str, pages: int) -> List[str]:
@@ -431,12 +708,22 @@ def get_comic_pages_by_name_and_pages(name: str, pages: int) -> List[str]:
     :param pages: Number of pages in comic
     :return: List of URLs for comic pages
     """
-    image_urls = []
-    for i in range(1, pages + 1):
-        url = COMICS_URL.format(comic_name=name.replace(' ', '%20'), page_number=i)
-        image_urls.append(url)
+    comic_name = _encode_comic_name(name)
+    return [COMICS_URL.format(comic_name=comic_name, page_number=i) for i in range(1, pages + 1)]
 
-    return image_urls
+
+def _get_or_none(url: str) -> requests.Response:
+    """
+    Gets a URL with the shared session, treating timeouts and connection errors
+    (raised once the retries run out) like any other failed request.
+    :param url: URL to get
+    :return: Response, or None if the request failed
+    """
+    try:
+        return _session.get(url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Error getting {url}: {e!r}")
+        return None
 
 
 def get_comic_data_by_name(name: str) -> DetailedComicData:
@@ -446,9 +733,9 @@ def get_comic_data_by_name(name: str) -> DetailedComicData:
     :return: Comic data
     """
     url = f"{API_URL}/comics/{name}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = json.loads(response.text)
+    response = _get_or_none(url)
+    if response is not None and response.status_code == 200:
+        data = orjson.loads(response.content)
         comic_data = {
             'name': data['name'],
             'numberOfPages': data['numberOfPages'],
@@ -472,9 +759,9 @@ def get_all_comics() -> List[BasicComicData]:
     :return: All comics
     """
     url = f'{API_URL}/all-comics'
-    response = requests.get(url)
-    if response.status_code == 200:
-        all_comic_data = json.loads(response.text)
+    response = _get_or_none(url)
+    if response is not None and response.status_code == 200:
+        all_comic_data = orjson.loads(response.content)
         comics = []
         for data in all_comic_data:
             comic_data = {
@@ -500,9 +787,9 @@ def get_all_comics_full() -> List[ComicData]:
     :return: All comics
     """
     url = f'{API_URL}/all-comics'
-    response = requests.get(url)
-    if response.status_code == 200:
-        return [ComicData.from_basic_and_detailed(BasicComicData(**comic), get_comic_data_by_name(comic['name'])) for comic in json.loads(response.text)]
+    response = _get_or_none(url)
+    if response is not None and response.status_code == 200:
+        return [ComicData.from_basic_and_detailed(BasicComicData(**comic), get_comic_data_by_name(comic['name'])) for comic in orjson.loads(response.content)]
     else:
         return None
 
@@ -512,6 +799,7 @@ def main():
     if not os.path.exists(DATABASE):
         print('Database does not exist. Creating...')
         create_database()
+    migrate_database()
     update_db()
 
 